@@ -2,15 +2,24 @@
 
 import unittest
 import pathlib
+import stat
 import sys
 import filecmp
 import doctest
+import contextlib
+import io
+import threading
+import unittest.mock
+import zipfile
 
 ROOT_PATH = pathlib.Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT_PATH))
 
+import ygrader.grades_csv
+import ygrader.learning_suite
 import ygrader.student_repos
 from ygrader import Grader, CodeSource
+from ygrader.grading_item import GradeItem
 
 TEST_PATH = ROOT_PATH / "test"
 TEST_RESOURCES_PATH = TEST_PATH / "resources"
@@ -92,8 +101,138 @@ class TestLearningSuite(unittest.TestCase):
         grader.set_learning_suite_groups(TEST_RESOURCES_PATH / "groups3.csv")
         grader.run()
 
+    def test_zero_date(self):
+        # Some zip tools write a zero DOS date, which has a month and day of 0
+        zip_bytes = io.BytesIO()
+        with zipfile.ZipFile(zip_bytes, "w") as zip_file:
+            zip_file.writestr(
+                zipfile.ZipInfo("Jane_Doe_jd1_file_1.txt", (1980, 0, 0, 0, 0, 0)), "a"
+            )
+            zip_file.writestr(
+                zipfile.ZipInfo("Jane_Doe_jd1_file_2.txt", (2021, 9, 1, 12, 0, 0)), "b"
+            )
+
+        student_work_path = TEST_PATH / "temp" / "zero_date_test"
+        with zipfile.ZipFile(zip_bytes) as zip_file:
+            extracted_by_name, _ = ygrader.learning_suite.extract_student_files(
+                zip_file, ["jd1"], student_work_path
+            )
+
+        self.assertEqual(sorted(extracted_by_name), ["file_1.txt", "file_2.txt"])
+        self.assertLess(extracted_by_name["file_1.txt"], extracted_by_name["file_2.txt"])
+        self.assertEqual((student_work_path / "file_1.txt").read_text(), "a")
+
+    def test_netid_in_name(self):
+        # A student's name can contain another student's Net ID
+        zip_bytes = io.BytesIO()
+        with zipfile.ZipFile(zip_bytes, "w") as zip_file:
+            zip_file.writestr("jeff_goeders_jgoeders_file_1.txt", "a")
+            zip_file.writestr("sam_smith_goeders_file_2.txt", "b")
+
+        with zipfile.ZipFile(zip_bytes) as zip_file:
+            files_by_netid = ygrader.learning_suite.index_submissions(
+                zip_file, ["jgoeders", "goeders"]
+            )
+            extracted_by_name, _ = ygrader.learning_suite.extract_student_files(
+                zip_file, ["jgoeders"], TEST_PATH / "temp" / "netid_in_name_test", files_by_netid
+            )
+
+        self.assertEqual(sorted(extracted_by_name), ["file_1.txt"])
+
+    def test_zip_file_per_thread(self):
+        zip_files = []
+        with ygrader.learning_suite.ZipFilePerThread(
+            TEST_RESOURCES_PATH / "submissions.zip"
+        ) as zip_per_thread:
+            zip_files.append(zip_per_thread.get())
+            zip_files.append(zip_per_thread.get())
+            thread = threading.Thread(target=lambda: zip_files.append(zip_per_thread.get()))
+            thread.start()
+            thread.join()
+
+        self.assertIs(zip_files[0], zip_files[1])
+        self.assertIsNot(zip_files[0], zip_files[2])
+        self.assertTrue(all(zip_file.fp is None for zip_file in zip_files))
+
     def group_grader_1(self, **kw):
         return 1.5
 
     def group_grader_2(self, **kw):
         return (2, 3.0)
+
+
+class TestCallbacks(unittest.TestCase):
+    def test_unhashable_callback(self):
+        # Defining __eq__ without __hash__ makes a callable object unhashable
+        class Runner:
+            def __eq__(self, other):
+                return self is other
+
+            def __call__(self, **kw):
+                return 0
+
+        grader = Grader(
+            "unhashable_test",
+            TEST_RESOURCES_PATH / "grades2.csv",
+            work_path=TEST_PATH / "temp",
+        )
+        runner = Runner()
+        grader.add_item_to_grade("lab1", runner)
+        grader.add_item_to_grade("lab1m2", runner)
+        self.assertEqual(len(grader.items), 2)
+
+
+class TestScoreInput(unittest.TestCase):
+    def test_get_scores(self):
+        # float() accepts these, but they aren't grades, so they are taken as feedback
+        grader = Grader(
+            "score_input_test", TEST_RESOURCES_PATH / "grades2.csv", work_path=TEST_PATH / "temp"
+        )
+        grader.work_path.mkdir(parents=True, exist_ok=True)
+        item = GradeItem(grader, ("lab1",), None, (10,), None, "lab1m2", None)
+
+        with unittest.mock.patch(
+            "builtins.input", side_effect=["1_0", "inf", "nan", "5"]
+        ), contextlib.redirect_stdout(io.StringIO()):
+            scores, feedback = item._get_scores("Jane Doe")
+
+        self.assertEqual(scores, [5.0])
+        self.assertEqual(feedback, "1_0. Inf. Nan")
+        self.assertIn("Nan", item.feedback_list)
+
+        for txt in ("2.5", " 3 ", ".5", "1e0"):
+            with unittest.mock.patch(
+                "builtins.input", side_effect=[txt]
+            ), contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(item._get_scores("Jane Doe"), ([float(txt)], ""))
+
+
+class TestGradesCsv(unittest.TestCase):
+    def test_other_columns_unchanged(self):
+        # Columns that aren't graded are written back as they were read, even if pyarrow (which
+        # infers timestamps) is installed
+        csv_path = TEST_PATH / "temp" / "grades_roundtrip.csv"
+        csv_path.parent.mkdir(parents=True, exist_ok=True)
+        csv_text = "Last Name,First Name,Net ID,Submitted,lab1\nDoe,Jane,jd1,2021-09-02T11:30,\n"
+        csv_path.write_text(csv_text)
+
+        grades_df = ygrader.grades_csv.parse_and_check(csv_path, ["lab1"])
+        ygrader.grades_csv.write_csv(grades_df, csv_path)
+        self.assertEqual(csv_path.read_text(), csv_text)
+
+    def test_write_keeps_symlink_and_mode(self):
+        csv_path = TEST_PATH / "temp" / "grades_mode.csv"
+        link_path = TEST_PATH / "temp" / "grades_link.csv"
+        csv_path.parent.mkdir(parents=True, exist_ok=True)
+        csv_path.write_text("Last Name,First Name,Net ID,lab1\nDoe,Jane,jd1,\n")
+        csv_path.chmod(0o664)
+        link_path.unlink(missing_ok=True)
+        link_path.symlink_to(csv_path.name)
+
+        grades_df = ygrader.grades_csv.parse_and_check(link_path, ["lab1"])
+        grades_df.loc[0, "lab1"] = 5
+        ygrader.grades_csv.write_csv(grades_df, link_path)
+
+        self.assertTrue(link_path.is_symlink())
+        self.assertIn("jd1,5.0", csv_path.read_text())
+        self.assertEqual(stat.S_IMODE(csv_path.stat().st_mode), 0o664)
@@ -1,23 +1,55 @@
 """ Main ygrader module"""
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import pathlib
 import enum
-import re
 import zipfile
 import time
 import os
-import shutil
+import stat
+import sys
 from typing import Callable
 import inspect
 import pandas
 
 
 from . import grades_csv
-from . import utils, student_repos
+from . import learning_suite, utils, student_repos
 from .grading_item import GradeItem
 from .utils import CallbackFailed, directory_is_empty, print_color, TermColors, error, warning
 
 
+# Grades are written to the CSV file at most this often (seconds), so that callbacks that return
+# scores don't rewrite the whole file for every student.  Grades entered by hand take longer than
+# this, so they are still saved as soon as they are entered.
+_SAVE_GRADES_INTERVAL = 2.0
+
+# Note appended to an extracted file in the listing when several versions were submitted
+_DUPLICATE_SUBMISSIONS_FMT = (
+    " " + TermColors.YELLOW + "({} versions submitted, using last modified.) " + TermColors.END
+)
+
+# Arguments always passed to callback functions, and those only passed if the data is available
+_CALLBACK_ARGS = (
+    "lab_name",
+    "student_code_path",
+    "run",
+    "build",
+    "first_names",
+    "last_names",
+    "net_ids",
+)
+_CALLBACK_ARGS_OPTIONAL = ("section", "homework_id")
+_CALLBACK_ARGS_OPTIONAL_SET = frozenset(_CALLBACK_ARGS_OPTIONAL)
+
+# Column added to the grouped DataFrame by _add_work_path_column()
+_WORK_PATH_COL = "_student_work_path"
+
+# Callback functions that have already been checked by _verify_callback_fcn()
+_verified_callbacks = set()
+
+
 class CodeSource(enum.Enum):
     """Used to indicate whether the student code is submitted via LearningSuite or Github"""
 
@@ -48,11 +80,9 @@ class Grader:
             code would be placed in './lab3'.  By default the working path is a "temp" folder created in your working directory.
         """
         self.lab_name = lab_name
-        self.grades_csv_path = pathlib.Path(grades_csv_path).resolve()
 
         # Make sure grades csv exists, and that file is writable
-        if not self.grades_csv_path.is_file():
-            error("grades_csv_path", "(" + str(grades_csv_path) + ")", "does not exist")
+        self.grades_csv_path = _resolve_existing_file(grades_csv_path, "grades_csv_path")
         try:
             with open(grades_csv_path, "a", encoding="utf-8"):
                 pass
@@ -69,12 +99,13 @@ class Grader:
 
         # Read CSV and make sure it isn't empty
         try:
-            pandas.read_csv(self.grades_csv_path)
+            grades_csv.read_csv_columns(self.grades_csv_path)
         except pandas.errors.EmptyDataError:
             error("Your grades csv", "(" + str(grades_csv_path) + ")", "appears to be empty")
 
         # Initialize other class members
         self.items = []
+        self._cols_to_grade = None
         self.code_source = None
         self.prep_fcn = None
         self.learning_suite_submissions_zip_path = None
@@ -84,6 +115,11 @@ class Grader:
         self.github_https = None
         self.groups_csv_path = None
         self.groups_csv_col_name = None
+        self._prefetched_submissions = {}
+        self._extracted_paths = set()
+        self._existing_work_dirs = set()
+        self._unsaved_grades = False
+        self._last_save_time = 0.0
         self.set_other_options()
 
     def add_item_to_grade(
@@ -194,28 +230,28 @@ class Grader:
                     "They must be equal.",
                 )
 
-        df = pandas.read_csv(self.grades_csv_path)
+        columns = grades_csv.read_csv_columns(self.grades_csv_path)
         for col_name in csv_col_names:
-            if col_name is not None and col_name not in df:
+            if col_name is not None and col_name not in columns:
                 error(
                     "Provided grade column name",
                     "(" + col_name + ")",
                     "does not exist in grades_csv_path",
                     "(" + str(self.grades_csv_path) + ").",
                     "Columns:",
-                    list(df.columns),
+                    list(columns),
                 )
 
         if feedback_filename is not None and feedback_col_name is not None:
             error("Provide only one of feedback_filename or feedback_col_name")
-        if feedback_col_name and feedback_col_name not in df:
+        if feedback_col_name and feedback_col_name not in columns:
             error(
                 "Provided feedback_col_name",
                 "(" + feedback_col_name + ")",
                 "does not exist in grades_csv_path",
                 "(" + str(self.grades_csv_path) + ").",
                 "Columns:",
-                list(df.columns),
+                list(columns),
             )
 
         item = GradeItem(
@@ -229,6 +265,7 @@ class Grader:
         )
         _verify_callback_fcn(grading_fcn, item)
         self.items.append(item)
+        self._cols_to_grade = None
 
     def add_analysis_item(
         self,
@@ -255,13 +292,10 @@ class Grader:
         zip_path: pathlib.Path | str
             Path to the zip file that was downloaded from Learning Suite using *Batch Download*.
         """
-        zip_path = pathlib.Path(zip_path).resolve()
-
         self.code_source = CodeSource.LEARNING_SUITE
-        self.learning_suite_submissions_zip_path = zip_path
-
-        if not zip_path.is_file():
-            error("Provided zip_path", zip_path, "does not exist")
+        self.learning_suite_submissions_zip_path = _resolve_existing_file(
+            zip_path, "Provided zip_path"
+        )
 
     def set_submission_system_github(
         self, tag, github_url_csv_path, repo_col_name="github_url", use_https=False
@@ -284,20 +318,14 @@ class Grader:
             credentials over https, set this to True.
         """
         self.code_source = CodeSource.GITHUB
-        self.github_csv_path = pathlib.Path(github_url_csv_path).resolve()
+        self.github_csv_path = _resolve_existing_file(
+            github_url_csv_path, "Provided github_url_csv_path"
+        )
         self.github_csv_col_name = repo_col_name
         self.github_tag = tag
         self.github_https = use_https
 
-        if not github_url_csv_path.is_file():
-            error(
-                "Provided github_url_csv_path",
-                "(" + str(github_url_csv_path) + ")",
-                "does not exist",
-            )
-
-        df = pandas.read_csv(github_url_csv_path)
-        if repo_col_name not in df:
+        if repo_col_name not in grades_csv.read_csv_columns(self.github_csv_path):
             error(
                 "Provided repo_col_name",
                 "(" + repo_col_name + ")",
@@ -322,14 +350,10 @@ class Grader:
                 "Please call set_submission_system_learning_suite() before calling set_learning_suite_groups()."
             )
 
-        self.groups_csv_path = pathlib.Path(csv_path).resolve()
+        self.groups_csv_path = _resolve_existing_file(csv_path, "Provided groups csv_path")
         self.groups_csv_col_name = col_name
 
-        if not csv_path.is_file():
-            error("Provided groups csv_path", csv_path, "does not exist")
-
-        df = pandas.read_csv(self.groups_csv_path)
-        if col_name not in df:
+        if col_name not in grades_csv.read_csv_columns(self.groups_csv_path):
             error("Provided groups col_name", col_name, "does not exist in", csv_path)
 
     def set_other_options(
@@ -342,6 +366,7 @@ class Grader:
         prep_fcn=None,
         dry_run_first=False,
         dry_run_all=False,
+        quote_all_csv=False,
     ):
         """
         This can be used to set other options for the grader.
@@ -377,6 +402,9 @@ class Grader:
         dry_run_all: bool
             Perform a dry run, calling your callback function to perform grading, but not updating the grades CSV file.
             The callback is run for each student.
+        quote_all_csv: bool
+            Quote every field when saving the grades CSV file, as older versions of ygrader did.  By default
+            only fields that need it (e.g. those containing commas) are quoted.
         """
         self.format_code = format_code
         self.build_only = build_only
@@ -396,6 +424,7 @@ class Grader:
             error("Select only one of 'dry_run_first' and 'dry_run_all'")
         self.dry_run_first = dry_run_first
         self.dry_run_all = dry_run_all
+        self.quote_all_csv = quote_all_csv
 
     def _validate_config(self):
         """Check that everything has been configured before running"""
@@ -414,7 +443,9 @@ class Grader:
 
     def _get_all_csv_cols_to_grade(self):
         """Collect all columns that will be graded into a single list"""
-        return [col for item in self.items for col in item.csv_col_names]
+        if self._cols_to_grade is None:
+            self._cols_to_grade = [col for item in self.items for col in item.csv_col_names]
+        return self._cols_to_grade
 
     def run(self):
         """Call this to start (or resume) the grading process"""
@@ -424,10 +455,10 @@ class Grader:
         # Print starting message
         print_color(TermColors.BLUE, "Running grader for", self.lab_name)
 
+        cols_to_grade = self._get_all_csv_cols_to_grade()
+
         # Read in CSV and validate.  Print # students who need a grade
-        student_grades_df = grades_csv.parse_and_check(
-            self.grades_csv_path, self._get_all_csv_cols_to_grade()
-        )
+        student_grades_df = grades_csv.parse_and_check(self.grades_csv_path, cols_to_grade)
 
         # Convert columns
         for item in self.items:
@@ -436,17 +467,10 @@ class Grader:
                     item.feedback_col_name
                 ].fillna("")
 
-        # Filter by students who need a grade
-        grades_needed_df = grades_csv.filter_need_grade(
-            student_grades_df, self._get_all_csv_cols_to_grade()
-        )
+        # Count students who need a grade
         print_color(
             TermColors.BLUE,
-            str(
-                grades_csv.filter_need_grade(
-                    grades_needed_df, self._get_all_csv_cols_to_grade()
-                ).shape[0]
-            ),
+            str(grades_csv.count_need_grade(student_grades_df, cols_to_grade)),
             "students need to be graded.",
         )
 
@@ -455,46 +479,87 @@ class Grader:
         # For learning suite, if set_groups() was never called, then  students are placed in groups by Net ID (so every student in their own group)
         grouped_df = self._group_students(student_grades_df)
 
+        # Skip students/groups that are already fully graded
+        if not any(item.analysis_only for item in self.items):
+            grouped_df = grades_csv.filter_groups_need_grade(grouped_df, cols_to_grade)
+
+        # The directory of each student/group is needed several times, so build the paths once
+        grouped_df = self._add_work_path_column(grouped_df)
+
         # Create working path directory
         self._create_work_path()
 
         # For learning suite, unzip their submission and add a column that points to it
         if self.code_source == CodeSource.LEARNING_SUITE:
-            pass
+            self._prefetch_student_code(grouped_df)
             # self._unzip_submissions()
             # sys.exit(0)
             # grouped_df = self._add_submitted_zip_path_column(grouped_df)
 
-        self._run_grading(student_grades_df, grouped_df)
+        try:
+            self._run_grading(student_grades_df, grouped_df)
+        finally:
+            # Make sure no grades are lost, including on Ctrl+C or error exit
+            self._save_grades(student_grades_df, force=True)
+
+    def _save_grades(self, student_grades_df, force=False):
+        """Write any recorded grades to the grades CSV file.  Unless force is set, this is skipped
+        if the file was written very recently; run() always saves on the way out."""
+        if not self._unsaved_grades:
+            return
+        if not force and time.monotonic() - self._last_save_time < _SAVE_GRADES_INTERVAL:
+            return
+        grades_csv.write_csv(student_grades_df, self.grades_csv_path, self.quote_all_csv)
+        self._unsaved_grades = False
+        self._last_save_time = time.monotonic()
 
     def _run_grading(self, student_grades_df, grouped_df):
-        # Loop through all of the students/groups and perform grading
-        for _, row in grouped_df.iterrows():
+        # These options don't change during grading
+        run = not self.build_only
+        build = not self.run_only
+
+        # Look up rows of student_grades_df by Net ID when recording grades
+        netid_index = grades_csv.index_netids(student_grades_df)
+
+        # Grades waiting on the save interval are written before any grade prompt, as the process
+        # may be killed (e.g. a dropped SSH session) while waiting for input
+        save_pending_grades = functools.partial(self._save_grades, student_grades_df, force=True)
+
+        # Names of the group members are printed several times per group, so join them up front
+        grouped_df = grades_csv.add_concated_names_column(grouped_df)
+
+        # Count the missing grades of each group for all items in one pass
+        grouped_df = grades_csv.add_num_need_grade_columns(
+            grouped_df, self._get_all_csv_cols_to_grade()
+        )
+
+        # Optional callback arguments, provided if the column exists in the grades CSV
+        optional_callback_args = {
+            callback_arg: col
+            for callback_arg, col in (
+                ("section", "Section Number"),
+                ("homework_id", "Course Homework ID"),
+            )
+            if col in grouped_df.columns
+        }
+
+        # Loop through all of the students/groups and perform grading.
+        # Rows are plain dicts, which avoids building a pandas Series for every group.
+        for row in grouped_df.to_dict("records"):
             first_names = grades_csv.get_first_names(row)
             last_names = grades_csv.get_last_names(row)
             net_ids = grades_csv.get_net_ids(row)
             concated_names = grades_csv.get_concated_names(row)
 
-            # Check if student/group needs grading
-            if not any(item.analysis_only for item in self.items):
-                num_group_members_need_grade_per_item = [
-                    item.num_grades_needed(row) for item in self.items
-                ]
-
-                if sum(sum(s) for s in num_group_members_need_grade_per_item) == 0:
-                    # This student/group is already fully graded
-                    continue
-
-            # Print name(s) of who we are grading
-            student_work_path = self.work_path / utils.names_to_dir(
-                first_names, last_names, net_ids
-            )
+            # Print name(s) of who we are grading.  The student directory is always directly in
+            # work_path, so its path relative to the parent is known without Path.relative_to().
+            student_work_path = self._get_student_work_path(row)
             print_color(
                 TermColors.PURPLE,
                 "\nGrading: ",
                 concated_names,
                 "-",
-                student_work_path.relative_to(self.work_path.parent),
+                os.path.join(self.work_path.name, student_work_path.name),
             )
 
             # Get student code from zip or github.  If this fails it returns False.
@@ -511,20 +576,18 @@ class Grader:
             callback_args = {}
             callback_args["lab_name"] = self.lab_name
             callback_args["student_code_path"] = student_work_path
-            callback_args["run"] = not self.build_only
+            callback_args["run"] = run
             callback_args["first_names"] = first_names
             callback_args["last_names"] = last_names
             callback_args["net_ids"] = net_ids
-            if "Section Number" in row:
-                callback_args["section"] = row["Section Number"]
-            if "Course Homework ID" in row:
-                callback_args["homework_id"] = row["Course Homework ID"]
+            for callback_arg, col in optional_callback_args.items():
+                callback_args[callback_arg] = row[col]
 
             if self.prep_fcn is not None:
                 try:
                     self.prep_fcn(
                         **callback_args,
-                        build=not self.run_only,
+                        build=build,
                     )
                 except CallbackFailed as e:
                     print_color(TermColors.RED, repr(e))
@@ -534,7 +597,11 @@ class Grader:
 
             # Loop through all items that are to be graded
             for item in self.items:
-                item.run_grading(student_grades_df, row, callback_args)
+                if item.run_grading(
+                    student_grades_df, row, callback_args, netid_index, save_pending_grades
+                ):
+                    self._unsaved_grades = True
+                    self._save_grades(student_grades_df)
 
             if self.dry_run_first:
                 print_color(
@@ -542,40 +609,89 @@ class Grader:
                 )
                 break
 
+    def _get_student_work_path(self, row):
+        """Return the directory where the code for the student/group in this row is placed"""
+        if _WORK_PATH_COL in row:
+            return row[_WORK_PATH_COL]
+        return self.work_path / utils.names_to_dir(
+            grades_csv.get_first_names(row),
+            grades_csv.get_last_names(row),
+            grades_csv.get_net_ids(row),
+        )
+
+    def _add_work_path_column(self, grouped_df):
+        """Return a copy of the grouped DataFrame with a column holding _get_student_work_path()
+        for each row"""
+        paths = [
+            self.work_path / utils.names_to_dir(first_names, last_names, net_ids)
+            for first_names, last_names, net_ids in zip(
+                grouped_df["First Name"], grouped_df["Last Name"], grouped_df["Net ID"]
+            )
+        ]
+        return grouped_df.assign(**{_WORK_PATH_COL: paths})
+
     def _unzip_submissions(self):
+        # Files already in the work directory, from one scan rather than a stat per member
+        with os.scandir(self.work_path) as it:
+            existing_files = {entry.name for entry in it if entry.is_file()}
+
         with zipfile.ZipFile(self.learning_suite_submissions_zip_path, "r") as f:
+            to_extract = []
             for zip_info in f.infolist():
                 # Remove old zip file if it exists
                 unpack_path = self.work_path / zip_info.filename
-                if unpack_path.is_file():
+                if zip_info.filename in existing_files:
                     unpack_path.unlink()
 
-                # Unzip
-                f.extract(zip_info, self.work_path)
+                if zip_info.is_dir():
+                    unpack_path.mkdir(parents=True, exist_ok=True)
+                    continue
+
+                unpack_path.parent.mkdir(parents=True, exist_ok=True)
+                to_extract.append((zip_info, unpack_path))
+
+        # Unzip.  Each submission is written to its own file, so they can be extracted in
+        # parallel.  A ZipFile isn't safe to share between threads, so each worker opens the zip.
+        zip_path = self.learning_suite_submissions_zip_path
+        with learning_suite.ZipFilePerThread(zip_path) as zip_per_thread:
+
+            def extract(item):
+                zip_info, unpack_path = item
+                mtime = learning_suite.zip_info_mtime(zip_info)
+                learning_suite.extract_zip_member(
+                    zip_per_thread.get(), zip_info, unpack_path, mtime
+                )
 
-                # Fix timestamp
-                date_time = time.mktime(zip_info.date_time + (0, 0, -1))
-                os.utime(unpack_path, (date_time, date_time))
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                # Consume the results so that any exception is raised here
+                list(executor.map(extract, to_extract))
 
     def _add_submitted_zip_path_column(self, df):
         # Map dataframe index to student zip file
         df_idx_to_zip_path = {}
 
-        for index, row in df.iterrows():
-            net_ids = grades_csv.get_net_ids(row)
-
+        # Index the zip files by each '_<name part>_' in their filename (ie. everything that
+        # could match '*_<netid>_*.zip'), so the work directory is only scanned once
+        zip_entries_by_name_part = defaultdict(list)
+        with os.scandir(self.work_path) as it:
+            for entry in it:
+                if entry.name.endswith(".zip"):
+                    for name_part in set(entry.name[: -len(".zip")].split("_")[1:-1]):
+                        zip_entries_by_name_part[name_part].append(entry)
+
+        # Only the Net IDs are needed, so iterate the column rather than building a Series per row
+        for index, net_ids in zip(df.index, df["Net ID"].to_list()):
             # Find all submissions that belong to the group
             zip_matches = []
             for net_id in net_ids:
-                zip_matches.extend(list(self.work_path.glob("*_" + net_id + "_*.zip")))
+                zip_matches.extend(zip_entries_by_name_part.get(net_id, ()))
             if len(zip_matches) == 0:
                 # print("No zip files match", group_name)
                 continue
-            if len(zip_matches) > 1:
-                # Multiple submissions -- get the latest one
-                zip_matches.sort(key=lambda x: x.stat().st_mtime, reverse=True)
 
-            df_idx_to_zip_path[index] = zip_matches[0]
+            # If there are multiple submissions, get the latest one (DirEntry caches its stat)
+            latest = max(zip_matches, key=lambda x: x.stat().st_mtime)
+            df_idx_to_zip_path[index] = pathlib.Path(latest.path)
 
         df["submitted_zip_path"] = pandas.Series(df_idx_to_zip_path)
         df["submitted_zip_path"] = df["submitted_zip_path"].fillna(value="")
@@ -587,8 +703,6 @@ class Grader:
             df = grades_csv.match_to_github_url(
                 df, self.github_csv_path, self.github_csv_col_name, self.github_https
             )
-
-            df_needs_grades = grades_csv.filter_need_grade(df, self._get_all_csv_cols_to_grade())
             groupby_column = "github_url"
 
         elif self.groups_csv_path is None:
@@ -605,15 +719,14 @@ class Grader:
             )
 
             # Check how many students remain
-            df_needs_grades = grades_csv.filter_need_grade(df, self._get_all_csv_cols_to_grade())
             print_color(
                 TermColors.BLUE,
-                str(df_needs_grades.shape[0]),
+                str(grades_csv.count_need_grade(df, self._get_all_csv_cols_to_grade())),
                 "of these students belong to a group.",
             )
 
         # Group students into their groups
-        return df.groupby(groupby_column).agg(list).reset_index()
+        return grades_csv.group_to_lists(df, groupby_column)
 
     def _get_student_code(self, row, student_work_path):
         if self.code_source == CodeSource.GITHUB:
@@ -623,7 +736,9 @@ class Grader:
         return self._get_student_code_learning_suite(row, student_work_path)
 
     def _get_student_code_github(self, row, student_work_path):
-        student_work_path.mkdir(parents=True, exist_ok=True)
+        if student_work_path not in self._existing_work_dirs:
+            student_work_path.mkdir(parents=True, exist_ok=True)
+            self._existing_work_dirs.add(student_work_path)
 
         # Clone student repo
         print("Student repo url: " + row["github_url"])
@@ -633,134 +748,191 @@ class Grader:
 
     def _get_student_code_learning_suite(self, row, student_work_path):
         print("Extracting submitted files for", grades_csv.get_concated_names(row), "...")
-        if student_work_path.is_dir() and not directory_is_empty(student_work_path):
+        if student_work_path in self._prefetched_submissions:
+            # Code was already extracted in parallel before grading started
+            extracted_by_name, count_by_filename = self._prefetched_submissions.pop(
+                student_work_path
+            )
+        elif student_work_path in self._extracted_paths:
             # Code already extracted from Zip, return
             print("  Files already extracted previously.")
             return True
+        else:
+            with zipfile.ZipFile(self.learning_suite_submissions_zip_path, "r") as top_zip:
+                extracted_by_name, count_by_filename = learning_suite.extract_student_files(
+                    top_zip, grades_csv.get_net_ids(row), student_work_path
+                )
 
-        student_work_path.mkdir(parents=True, exist_ok=True)
-
-        # Keep track of last file extracted by name
-        extracted_by_name = {}
-
-        # Track how many files of each name are extracted so we can warn about duplicate submissions
-        count_by_filename = defaultdict(int)
-
-        with zipfile.ZipFile(self.learning_suite_submissions_zip_path, "r") as top_zip:
-            # Loop through all files in top-level zip file
-            for file in top_zip.infolist():
-                if file.is_dir():
-                    continue
-
-                # Loop through everyone in the group
-                for netid in grades_csv.get_net_ids(row):
-                    # Check if file belongs to student
-                    match = re.match("^.*?_" + netid + "_(.*)$", file.filename)
-                    if not match:
-                        match = re.match("^.*? " + netid + "-(.*)$", file.filename)
-                    if not match:
-                        continue
-
-                    # Handle regular files (not zip files)
-                    if not file.filename.lower().endswith(".zip"):
-                        extract_to_name = match.group(1)
-
-                        count_by_filename[extract_to_name] += 1
-
-                        # If we've already extracted a file of this name, don't overwrite if older
-                        if extract_to_name in extracted_by_name:
-                            if file.date_time <= extracted_by_name[extract_to_name].date_time:
-                                continue
-                        top_zip.extract(file, student_work_path)
-                        extracted_by_name[extract_to_name] = file
-
-                        # Rename to remove student name/netid from file
-                        unpack_old_path = student_work_path / file.filename
-                        unpack_new_path = student_work_path / extract_to_name
-                        unpack_old_path.rename(unpack_new_path)
-
-                        # Restore timestamp
-                        date_time = time.mktime(file.date_time + (0, 0, -1))
-                        os.utime(unpack_new_path, (date_time, date_time))
-                        continue
-
-                    # Otherwise this is a zip within zip. Open it up and collect contained files
-                    with zipfile.ZipFile(top_zip.open(file)) as inner_zip:
-                        for file2 in inner_zip.infolist():
-                            if file2.is_dir():
-                                continue
-                            count_by_filename[file2.filename] += 1
-
-                            # If we've already extracted a file of this name, don't overwrite if older
-                            if file2.filename in extracted_by_name:
-                                if file2.date_time <= extracted_by_name[file2.filename].date_time:
-                                    continue
-
-                            inner_zip.extract(file2, student_work_path)
-                            extracted_by_name[file2.filename] = file2
-
-                            # Restore timestamp
-                            unpack_path = student_work_path / file2.filename
-                            date_time = time.mktime(file2.date_time + (0, 0, -1))
-                            os.utime(unpack_path, (date_time, date_time))
-
-        # Print what was extracted
-        for k in sorted(extracted_by_name.keys()):
-            print("  ", k, end=" ")
+        # Print what was extracted, as a single write since there may be many files
+        lines = []
+        for k in sorted(extracted_by_name):
+            lines.append("   " + k)
             if count_by_filename[k] > 1:
-                print_color(
-                    TermColors.YELLOW,
-                    "(" + str(count_by_filename[k]),
-                    "versions submitted, using last modified.)",
-                )
-            else:
-                print()
+                lines.append(_DUPLICATE_SUBMISSIONS_FMT.format(count_by_filename[k]))
+            lines.append("\n")
+        sys.stdout.write("".join(lines))
 
         # Return success if at least one file is obtained
         if len(extracted_by_name) == 0:
             print_color(TermColors.YELLOW, "No submission")
             return False
 
+        self._extracted_paths.add(student_work_path)
         return True
 
+    def _prefetch_student_code(self, grouped_df):
+        """Extract the Learning Suite submissions of all students/groups that will be graded.
+        Extraction is I/O bound and independent per student, so it is done in parallel."""
+        rows = grouped_df.to_dict("records")
+        if self.dry_run_first:
+            rows = rows[:1]
+
+        # Find the students whose code was extracted on a previous run
+        self._extracted_paths = {
+            path for path in self._existing_work_dirs if not directory_is_empty(path)
+        }
+
+        to_extract = {}
+        for row in rows:
+            student_work_path = self._get_student_work_path(row)
+            if student_work_path in self._extracted_paths:
+                continue
+            to_extract[student_work_path] = grades_csv.get_net_ids(row)
+
+        if not to_extract:
+            return
+
+        print_color(
+            TermColors.BLUE, "Extracting submissions for", len(to_extract), "students/groups"
+        )
+
+        # Find everyone's files with one pass over the zip, rather than one pass per student
+        with zipfile.ZipFile(self.learning_suite_submissions_zip_path, "r") as top_zip:
+            files_by_netid = learning_suite.index_submissions(
+                top_zip, [netid for net_ids in to_extract.values() for netid in net_ids]
+            )
+
+        # A ZipFile isn't safe to share between threads, so each worker opens the zip itself
+        zip_path = self.learning_suite_submissions_zip_path
+        with learning_suite.ZipFilePerThread(zip_path) as zip_per_thread:
+
+            def extract(net_ids, student_work_path):
+                return learning_suite.extract_student_files(
+                    zip_per_thread.get(), net_ids, student_work_path, files_by_netid
+                )
+
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                futures = {
+                    student_work_path: executor.submit(extract, net_ids, student_work_path)
+                    for student_work_path, net_ids in to_extract.items()
+                }
+                for student_work_path, future in futures.items():
+                    self._prefetched_submissions[student_work_path] = future.result()
+
     def _create_work_path(self):
+        try:
+            work_path_stat = os.stat(self.work_path)
+            work_path_exists = stat.S_ISDIR(work_path_stat.st_mode)
+        except FileNotFoundError:
+            work_path_exists = False
+
         if self.code_source == CodeSource.LEARNING_SUITE:
-            if self.work_path.is_dir() and (
-                self.learning_suite_submissions_zip_path.stat().st_mtime
-                > self.work_path.stat().st_mtime
+            if work_path_exists and (
+                os.stat(self.learning_suite_submissions_zip_path).st_mtime > work_path_stat.st_mtime
             ):
-                shutil.rmtree(self.work_path)
+                _parallel_rmtree(self.work_path)
+                work_path_exists = False
 
-        if not self.work_path.is_dir():
+        if not work_path_exists:
             print_color(TermColors.BLUE, "Creating", self.work_path)
             self.work_path.mkdir(exist_ok=True, parents=True)
+            self._existing_work_dirs = set()
+        else:
+            # Remember which student directories exist, so they aren't created again one by one
+            with os.scandir(self.work_path) as it:
+                self._existing_work_dirs = {
+                    pathlib.Path(entry.path) for entry in it if entry.is_dir()
+                }
+
+
+def _parallel_rmtree(path):
+    """Delete a directory tree, like shutil.rmtree, but unlink the files from a pool of threads
+    since removing a large tree of student files is bound by per-file syscalls."""
+    files = []
+    dirs = []
+    to_scan = [path]
+    while to_scan:
+        dir_path = to_scan.pop()
+        dirs.append(dir_path)
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    to_scan.append(entry.path)
+                else:
+                    files.append(entry.path)
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        # Consume the results so that any exception is raised here
+        list(executor.map(os.unlink, files))
+
+    # Directories were listed parent-first, so remove them in reverse
+    for dir_path in reversed(dirs):
+        os.rmdir(dir_path)
+
+
+def _resolve_existing_file(path, description):
+    """Return the absolute path of the given file, or exit with an error if it does not exist"""
+    path = pathlib.Path(path)
+    try:
+        is_file = stat.S_ISREG(os.stat(path).st_mode)
+    except OSError:
+        is_file = False
+    if not is_file:
+        error(description, "(" + str(path) + ")", "does not exist")
+    return path.resolve()
+
+
+def _get_argspec(fcn):
+    """Introspect a callback function, caching the result since the same callback is usually
+    registered for several items"""
+    try:
+        return _get_argspec_cached(fcn)
+    except TypeError:
+        # Callable objects that aren't hashable can't be cached
+        return inspect.getfullargspec(fcn)
+
+
+@functools.lru_cache(maxsize=256)
+def _get_argspec_cached(fcn):
+    return inspect.getfullargspec(fcn)
 
 
 def _verify_callback_fcn(fcn, item):
-    callback_args = [
-        "lab_name",
-        "student_code_path",
-        "run",
-        "build",
-        "first_names",
-        "last_names",
-        "net_ids",
-    ]
+    # This is only a sanity check of the user's code, so skip it when running with -O
+    if not __debug__:
+        return
+
+    # The required arguments depend on the item, so remember which checks have passed
+    verified_key = (fcn, item is not None, bool(item and item.max_points))
+    try:
+        if verified_key in _verified_callbacks:
+            return
+    except TypeError:
+        # Callable objects that aren't hashable are checked every time
+        verified_key = None
+
+    callback_args = _CALLBACK_ARGS
     if item:
         if item.max_points:
-            callback_args.append("max_points")
+            callback_args += ("max_points",)
 
         # If this is a fcn for a graded item (not a prep-only function), then
         # this argument is required.
-        callback_args.append("csv_col_names")
-
-    callback_args_optional = [
-        "section",
-        "homework_id",
-    ]
+        callback_args += ("csv_col_names",)
+    all_callback_args = _CALLBACK_ARGS_OPTIONAL_SET.union(callback_args)
 
     # Check that callback function(s) are valid
-    argspec = inspect.getfullargspec(fcn)
+    argspec = _get_argspec(fcn)
 
     # Check that kwargs is enabled
     if argspec.varkw is None:
@@ -769,31 +941,36 @@ def _verify_callback_fcn(fcn, item):
             "(" + fcn.__name__ + ")",
             "should accept keyward arguments (**kw). This is needed because the grader may provide "
             + "different optional arguments to your callback depending on what data it has available",
-            "(" + ",".join(callback_args_optional) + ").",
+            "(" + ",".join(_CALLBACK_ARGS_OPTIONAL) + ").",
         )
 
+    # Skip special arguments
+    named_args = argspec.args
+    if named_args and named_args[0] in ("self", "cls"):
+        named_args = named_args[1:]
+    named_args = frozenset(named_args)
+
     # Check that all named arguments are valid
-    for i, named_arg in enumerate(argspec.args):
-        # Skip special arguments
-        if named_arg in ("self", "cls") and i == 0:
-            continue
-        if (named_arg not in callback_args) and (named_arg not in callback_args_optional):
-            error(
-                "Your callback function",
-                "(" + fcn.__name__ + ")",
-                "takes a named argument",
-                "'" + named_arg + "'",
-                "but this is not provided by the grader. Please remove this argument or the grader "
-                + "will not be able to call your callback function correctly. Available callback arguments:",
-                str(callback_args),
-            )
-        elif named_arg not in callback_args:
-            warning(
-                "Your callback function",
-                "(" + fcn.__name__ + ")",
-                "takes a named argument",
-                "'" + named_arg + "'",
-                "but this argument is not always provided by the grader.",
-                "If it is missing from your grades CSV file this will cause a runtime error.",
-                "Please consider use keyword arguments (**kw) instead.",
-            )
+    for named_arg in sorted(named_args - all_callback_args):
+        error(
+            "Your callback function",
+            "(" + fcn.__name__ + ")",
+            "takes a named argument",
+            "'" + named_arg + "'",
+            "but this is not provided by the grader. Please remove this argument or the grader "
+            + "will not be able to call your callback function correctly. Available callback arguments:",
+            str(list(callback_args)),
+        )
+    for named_arg in sorted(named_args & _CALLBACK_ARGS_OPTIONAL_SET):
+        warning(
+            "Your callback function",
+            "(" + fcn.__name__ + ")",
+            "takes a named argument",
+            "'" + named_arg + "'",
+            "but this argument is not always provided by the grader.",
+            "If it is missing from your grades CSV file this will cause a runtime error.",
+            "Please consider use keyword arguments (**kw) instead.",
+        )
+
+    if verified_key is not None:
+        _verified_callbacks.add(verified_key)
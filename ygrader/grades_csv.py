@@ -1,14 +1,77 @@
 """ Manage the grade CSV file"""
 
+import csv
+import functools
+import importlib.util
+import os
+import pathlib
+import shutil
+
 import pandas
 
 from .student_repos import convert_github_url_format
 from .utils import TermColors, error, print_color, warning
 
 
+# Columns added by add_concated_names_column() and add_num_need_grade_columns()
+_CONCATED_NAMES_COL = "_concated_names"
+_NUM_NEED_GRADE_PREFIX = "_num_need_grade:"
+
+# pyarrow is optional.  If installed, its multi-threaded CSV parser is used for the CSV files
+# that are only read (github URLs and groups).
+_PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+
+def read_csv(csv_path, index_col=None, usecols=None):
+    """Read a CSV file into a DataFrame, using the pyarrow parser if it is available.  If usecols
+    is given, only those columns are parsed.  pyarrow infers column types differently (e.g. it
+    parses timestamps), so this is not used for the grades CSV, which is written back."""
+    if _PYARROW_AVAILABLE:
+        try:
+            # pyarrow never uses the first column as the index, but doesn't accept index_col=False
+            return pandas.read_csv(
+                csv_path,
+                engine="pyarrow",
+                index_col=None if index_col is False else index_col,
+                usecols=usecols,
+            )
+        except pandas.errors.ParserError:
+            # pyarrow rejects empty files and rows with a different number of fields than the
+            # header (common in Learning Suite exports), so let the default parser handle these.
+            pass
+    return pandas.read_csv(csv_path, index_col=index_col, usecols=usecols)
+
+
+def read_csv_columns(csv_path):
+    """Return the column names of a CSV file.  Only the header is parsed, and the result is
+    cached until the file is modified."""
+    return _read_csv_columns(csv_path, os.stat(csv_path).st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=None)
+def _read_csv_columns(csv_path, _mtime_ns):
+    return tuple(pandas.read_csv(csv_path, nrows=0).columns)
+
+
+def write_csv(df, csv_path, quote_all=False):
+    """Write the grades DataFrame to the CSV file.  The file is written under a temporary name and
+    then renamed, so an interrupted write can't leave a truncated grades file behind."""
+    # Replace the file a symlink points to rather than the link, and keep its permissions
+    csv_path = pathlib.Path(csv_path).resolve()
+    tmp_path = csv_path.with_name(csv_path.name + ".tmp")
+    df.to_csv(str(tmp_path), index=False, quoting=csv.QUOTE_ALL if quote_all else csv.QUOTE_MINIMAL)
+    try:
+        shutil.copymode(csv_path, tmp_path)
+    except FileNotFoundError:
+        pass
+    os.replace(tmp_path, csv_path)
+
+
 def parse_and_check(grades_csv_path, csv_cols):
     """Parse the grades CSV file and check that column names are valid"""
     try:
+        # Always use the default parser, so the columns ygrader doesn't grade are written back
+        # unchanged whether or not pyarrow is installed
         grades_df = pandas.read_csv(grades_csv_path)
     except pandas.errors.EmptyDataError:
         error(
@@ -36,20 +99,43 @@ def check_csv_column_names(df, expected_grade_col_names):
             )
 
 
+def _need_grade_mask(df, expected_grade_col_names):
+    """Boolean mask of the students that are missing a grade"""
+    return df[df.columns.intersection(expected_grade_col_names)].isnull().any(axis=1)
+
+
 def filter_need_grade(df, expected_grade_col_names):
     """Filter down to only those students that need a grade"""
-    filtered_df = df[
-        df[df.columns.intersection(expected_grade_col_names)].isnull().any(axis=1)
-    ]
+    filtered_df = df[_need_grade_mask(df, expected_grade_col_names)]
     return filtered_df
 
 
+def count_need_grade(df, expected_grade_col_names):
+    """Count the students that need a grade, without building a filtered copy of the DataFrame"""
+    return int(_need_grade_mask(df, expected_grade_col_names).sum())
+
+
+def filter_groups_need_grade(grouped_df, expected_grade_col_names):
+    """Filter grouped students down to only those groups where at least one member needs a grade"""
+    needs_grade = pandas.Series(False, index=grouped_df.index)
+    for col in grouped_df.columns.intersection(expected_grade_col_names):
+        needs_grade |= grouped_df[col].map(lambda grades: any(pandas.isnull(g) for g in grades))
+    return grouped_df[needs_grade]
+
+
 def match_to_github_url(
     df_needs_grade, github_csv_path, github_csv_col_name, use_https
 ):
     """Match students to their github URL"""
     try:
-        df_github = pandas.read_csv(github_csv_path, index_col=False)
+        # Only the Net ID and github URL columns are used, so don't parse the rest.  Header names
+        # are matched ignoring surrounding whitespace, as they are stripped below.
+        usecols = [
+            col
+            for col in read_csv_columns(github_csv_path)
+            if col.strip() in ("Net ID", github_csv_col_name)
+        ]
+        df_github = read_csv(github_csv_path, index_col=False, usecols=usecols)
     except pandas.errors.EmptyDataError:
         error(
             "Exception pandas.errors.EmptyDataError. Is your",
@@ -81,10 +167,8 @@ def match_to_github_url(
             "student(s) Net ID are missing a github URL:",
         )
 
-    for _, row in missing_netids.iterrows():
-        print_color(" ", TermColors.YELLOW, row["Net ID"])
-    for _, row in missing_df.iterrows():
-        print_color(" ", TermColors.YELLOW, row["Net ID"])
+    for netid in missing_netids["Net ID"].to_list() + missing_df["Net ID"].to_list():
+        print_color(" ", TermColors.YELLOW, netid)
 
     df_github = df_github.dropna()
 
@@ -104,8 +188,6 @@ def match_to_github_url(
 
 def add_group_column_from_csv(df, column_name, groups_csv_path, groups_csv_col_name):
     """Read the group names from the group CSV and join them to the original grades CSV"""
-    df_groups = pandas.read_csv(groups_csv_path)
-
     if column_name in df.columns:
         error(
             "The",
@@ -114,16 +196,18 @@ def add_group_column_from_csv(df, column_name, groups_csv_path, groups_csv_col_n
             "The same column name cannot exist in both places.",
         )
 
-    # Rename appropriate column to group
-    df_groups.rename(columns={groups_csv_col_name: column_name}, inplace=True)
-
-    # Filter down to relevant columns
-    if "Net ID" not in df_groups.columns:
+    if "Net ID" not in read_csv_columns(groups_csv_path):
         error(
             "Your group CSV",
             "(" + str(groups_csv_path) + ")",
             "is missing a 'Net ID' column.",
         )
+
+    # Only read the relevant columns
+    df_groups = read_csv(groups_csv_path, usecols=["Net ID", groups_csv_col_name])
+
+    # Rename appropriate column to group
+    df_groups.rename(columns={groups_csv_col_name: column_name}, inplace=True)
     df_groups = df_groups[["Net ID", column_name]]
 
     # Merge with student dataframe (inner merge will drop students not in group CSV)
@@ -132,8 +216,50 @@ def add_group_column_from_csv(df, column_name, groups_csv_path, groups_csv_col_n
     return df_joined
 
 
-def find_idx_for_netid(df, netid):
-    """Find the row index for a given student netid"""
+def group_to_lists(df, groupby_column):
+    """Group the rows by the given column, collecting the values of every other column into a list
+    per group.  This gives the same result as df.groupby(groupby_column).agg(list).reset_index(),
+    but groups with a single sort instead of a Python call for every group and column."""
+    codes, uniques = pandas.factorize(df[groupby_column], sort=True)
+
+    # Sort the rows by group, keeping their original order within each group.  Rows with a missing
+    # group (code -1) are dropped, as groupby() does.
+    order = codes.argsort(kind="stable")
+    order = order[codes[order] >= 0]
+    sorted_codes = codes[order]
+
+    # Row boundaries of each group in the sorted order
+    num_rows = len(order)
+    starts = ((sorted_codes[1:] != sorted_codes[:-1]).nonzero()[0] + 1).tolist()
+    bounds = [0, *starts, num_rows] if num_rows else [0]
+
+    grouped = {groupby_column: uniques}
+    for col in df.columns:
+        if col == groupby_column:
+            continue
+        values = df[col].to_numpy()[order].tolist()
+        grouped[col] = [values[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    return pandas.DataFrame(grouped)
+
+
+def index_netids(df):
+    """Return a dict mapping each Net ID to its row index in the DataFrame, for use with
+    find_idx_for_netid().  Net IDs that appear more than once are mapped to None."""
+    netid_index = {}
+    for idx, netid in zip(df.index, df["Net ID"].to_list()):
+        netid_index[netid] = None if netid in netid_index else idx
+    return netid_index
+
+
+def find_idx_for_netid(df, netid, netid_index=None):
+    """Find the row index for a given student netid.  If an index from index_netids() is
+    provided it is used instead of searching the DataFrame."""
+    if netid_index is not None:
+        idx = netid_index.get(netid)
+        if idx is None:
+            error("Could not find netid =", netid, "(find_idx_for_netid)")
+        return idx
+
     matches = df.index[df["Net ID"] == netid].tolist()
     if len(matches) != 1:
         error("Could not find netid =", netid, "(find_idx_for_netid)")
@@ -157,11 +283,47 @@ def get_last_names(row):
 
 def get_concated_names(row):
     """Return a concatenated list of group member names for the row"""
+    if _CONCATED_NAMES_COL in row:
+        return row[_CONCATED_NAMES_COL]
+    return _concat_names(get_first_names(row), get_last_names(row), get_net_ids(row))
+
+
+def add_concated_names_column(grouped_df):
+    """Return a copy of the grouped DataFrame with a column holding get_concated_names() for each
+    row, so the names are only joined once per group"""
+    names = [
+        _concat_names(first_names, last_names, net_ids)
+        for first_names, last_names, net_ids in zip(
+            grouped_df["First Name"], grouped_df["Last Name"], grouped_df["Net ID"]
+        )
+    ]
+    return grouped_df.assign(**{_CONCATED_NAMES_COL: names})
+
+
+def add_num_need_grade_columns(grouped_df, expected_grade_col_names):
+    """Return a copy of the grouped DataFrame with a column for each grade column, holding the
+    number of group members that are missing that grade (see get_num_need_grade())"""
+    counts = {}
+    for col in grouped_df.columns.intersection(expected_grade_col_names):
+        # One row per student, then count the missing grades back per group
+        counts[_NUM_NEED_GRADE_PREFIX + col] = (
+            grouped_df[col].explode().isnull().groupby(level=0).sum().astype(int)
+        )
+    return grouped_df.assign(**counts)
+
+
+def get_num_need_grade(row, col):
+    """Return the number of group members in the row that are missing a grade for the column"""
+    count_col = _NUM_NEED_GRADE_PREFIX + col
+    if count_col in row:
+        return row[count_col]
+    return sum(1 for grade in row[col] if pandas.isnull(grade))
+
+
+def _concat_names(first_names, last_names, net_ids):
     return ", ".join(
         [
             (first + " " + last + " (" + net_id + ")")
-            for (first, last, net_id) in zip(
-                get_first_names(row), get_last_names(row), get_net_ids(row)
-            )
+            for (first, last, net_id) in zip(first_names, last_names, net_ids)
         ]
     )
@@ -1,16 +1,18 @@
 """ Module to manage each item that is to be graded"""
 
 
-import csv
 import json
+import os
+import re
 import shutil
 import sys
 
-import pandas
-
 from .utils import CallbackFailed, TermColors, print_color, error
 from . import grades_csv, utils
 
+# Input at the grade prompt that is taken as a score.  Anything else is treated as feedback.
+_SCORE_REGEX = re.compile(r"\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*")
+
 
 class GradeItem:
     """Class to track each item that needs to be graded (ie, each item for which a grading callback
@@ -35,12 +37,15 @@ class GradeItem:
         else:
             self.analysis_only = False
 
-        # Feedback comments
-        self.feedback_list_path = self.grader.work_path / (str(csv_col_names) + ".json")
-        self.feedback_list = []
-        if self.feedback_list_path.is_file():
-            with open(self.feedback_list_path, encoding="utf-8") as f:
-                self.feedback_list = json.load(f)
+        # Read in previous feedback comments.  This must be done now, as the work directory may be
+        # deleted and recreated when grading starts.  These are stored one JSON string per line, so
+        # that new comments can be appended.  Older versions saved a single JSON list.
+        self.feedback_list_path = self.grader.work_path / (str(csv_col_names) + ".jsonl")
+        self._old_feedback_list_path = self.grader.work_path / (str(csv_col_names) + ".json")
+        self.feedback_list = self._load_feedback_list()
+
+        # For fast lookup of whether a comment has already been entered
+        self._feedback_set = set(self.feedback_list)
 
         # Feeback file directory
         if self.feedback_filename:
@@ -52,8 +57,45 @@ class GradeItem:
             )
             self.feedback_dir_path.mkdir(exist_ok=True, parents=True)
 
-    def run_grading(self, student_grades_df, row, callback_args):
-        """Run the grading process for this item"""
+    def _load_feedback_list(self):
+        """Return the previously entered feedback comments for this item"""
+        if self.feedback_list_path.is_file():
+            with open(self.feedback_list_path, encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+
+        if not self._old_feedback_list_path.is_file():
+            return []
+
+        # Convert the feedback list saved by an older version
+        with open(self._old_feedback_list_path, encoding="utf-8") as f:
+            feedback_list = json.load(f)
+        # Write the new file under a temporary name, so an interrupted conversion can't
+        # leave a partial list behind (the old file is kept until the rename)
+        tmp_path = self.feedback_list_path.with_name(self.feedback_list_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(_feedback_lines(feedback_list))
+        os.replace(tmp_path, self.feedback_list_path)
+        self._old_feedback_list_path.unlink()
+        return feedback_list
+
+    def _save_feedback(self, feedback):
+        """Append a new feedback comment (already added to feedback_list) to the feedback list file.
+        If the file is missing, e.g. because the work directory was recreated, the whole list is
+        written instead."""
+        if not self.feedback_list_path.is_file():
+            with open(self.feedback_list_path, "w", encoding="utf-8") as f:
+                f.write(_feedback_lines(self.feedback_list))
+            return
+        with open(self.feedback_list_path, "a", encoding="utf-8") as f:
+            f.write(_feedback_lines((feedback,)))
+
+    def run_grading(
+        self, student_grades_df, row, callback_args, netid_index=None, save_pending_grades=None
+    ):
+        """Run the grading process for this item.  Returns True if grades were recorded in
+        student_grades_df (the caller is responsible for saving them to the CSV file).
+        save_pending_grades is called before prompting the user, so that no grades are left
+        unsaved while waiting for input."""
         net_ids = grades_csv.get_net_ids(row)
         first_names = grades_csv.get_first_names(row)
         last_names = grades_csv.get_last_names(row)
@@ -70,7 +112,7 @@ class GradeItem:
         # (will be false if user chooses to just re-run and not re-build)
         build = True
 
-        if not self.analysis_only and sum(self.num_grades_needed(row)) == 0:
+        if not self.analysis_only and sum(num_group_members_need_grade_per_col) == 0:
             # No one in the group needs grades for this
             print_color(
                 TermColors.BLUE,
@@ -78,7 +120,7 @@ class GradeItem:
                 self.csv_col_names,
                 "(skipping)",
             )
-            return
+            return False
 
         while True:
             print_color(
@@ -133,6 +175,8 @@ class GradeItem:
             if scores is None:
                 if not self.analysis_only:
                     # If no score was returned by the callback function, prompt the user for a score.
+                    if save_pending_grades:
+                        save_pending_grades()
                     try:
                         scores, feedback = self._get_scores(concated_names)
                     except KeyboardInterrupt:
@@ -180,7 +224,7 @@ class GradeItem:
 
             # Record score
             for first_name, last_name, net_id in zip(first_names, last_names, net_ids):
-                row_idx = grades_csv.find_idx_for_netid(student_grades_df, net_id)
+                row_idx = grades_csv.find_idx_for_netid(student_grades_df, net_id, netid_index)
 
                 for i, col in enumerate(self.csv_col_names):
                     student_grades_df.at[row_idx, col] = scores[i]
@@ -219,98 +263,56 @@ class GradeItem:
                         self.feedback_zip_path.with_suffix(""), "zip", self.feedback_dir_path
                     )
 
-            student_grades_df.to_csv(
-                str(self.grader.grades_csv_path),
-                index=False,
-                quoting=csv.QUOTE_ALL,
-            )
-            break
+            return True
+
+        return False
 
     def num_grades_needed(self, row):
         """Return the number of total grades needed across all group members for
         each grade column in this row."""
-        empty_per_col = []
-        for col in self.csv_col_names:
-            empty_cnt = 0
-            for grade in row[col]:
-                if pandas.isnull(grade):
-                    empty_cnt += 1
-            empty_per_col.append(empty_cnt)
-        return empty_per_col
+        return [grades_csv.get_num_need_grade(row, col) for col in self.csv_col_names]
 
     def _get_scores(self, names):
         """Prompts the user for a score for the grade column(s)."""
         fpad = " " * 8
-        fpad2 = " " * 4
-        pad = 10
         feedback = ""
         scores = []
 
+        # These are checked on every prompt, so look them up once
+        feedback_enabled = self.feedback_enabled
+        feedback_list = self.feedback_list
+        feedback_set = self._feedback_set
+
         for i, grade_col in enumerate(self.csv_col_names):
             points = self.max_points[i] if self.max_points else None
+
+            ################### Build input menu #######################
+            # Everything but the pending feedback is the same on each prompt, so build it once.
+            # The menu only changes when new feedback is added to the feedback list.
+            header_txt = (
+                f"{TermColors.BLUE}Enter a grade for {names}, "
+                f"{TermColors.UNDERLINE}{grade_col}{TermColors.END}{TermColors.BLUE}:\n"
+            )
+            menu_txt, allowed_feedback, allowed_cmds = self._build_score_menu(points)
+            menu_feedback_len = len(feedback_list)
+
             while True:
                 print("")
                 if self.help_msg:
                     print_color(TermColors.BOLD, self.help_msg[i])
 
-                ################### Build input menu #######################
-                input_txt = (
-                    TermColors.BLUE
-                    + "Enter a grade for "
-                    + names
-                    + ", "
-                    + (TermColors.UNDERLINE + grade_col + TermColors.END + TermColors.BLUE)
-                    + ":\n"
-                )
+                if menu_feedback_len != len(feedback_list):
+                    menu_txt, allowed_feedback, allowed_cmds = self._build_score_menu(points)
+                    menu_feedback_len = len(feedback_list)
 
                 # Add current feedback
-                if self.feedback_enabled:
-                    input_txt += (
-                        fpad
-                        + "Pending feedback: "
-                        + TermColors.END
-                        + feedback
-                        + TermColors.BLUE
-                        + "\n"
+                if feedback_enabled:
+                    input_txt = (
+                        f"{header_txt}{fpad}Pending feedback: "
+                        f"{TermColors.END}{feedback}{TermColors.BLUE}\n{menu_txt}"
                     )
-
-                # Add score input
-                input_txt += (
-                    fpad2
-                    + (("0-" + str(points)) if points else "#").ljust(pad)
-                    + "Enter a score to finish and save\n"
-                )
-
-                # Enter feedback
-                allowed_feedback = {}
-                if self.feedback_enabled:
-                    input_txt += (
-                        fpad2
-                        + "str".ljust(pad)
-                        + "Enter a string with any new feedback, or select from previous feedback:\n"
-                    )
-                    for idx, f in enumerate(self.feedback_list):
-                        input_txt += fpad2 + ("f" + str(idx)).ljust(pad + 2) + f + "\n"
-                        allowed_feedback["f" + str(idx)] = f
-
-                    input_txt += fpad2 + "'c'".ljust(pad) + "Clear entered feedback\n"
-                    allowed_feedback["c"] = ""
-
-                input_txt += fpad2 + "'s'".ljust(pad) + "Skip to next student\n"
-                allowed_cmds = ["s"]
-
-                if self.grader.allow_rebuild:
-                    input_txt += fpad2 + "'b'".ljust(pad) + "Build and run again\n"
-                    allowed_cmds.append("b")
-                if self.grader.allow_rerun:
-                    input_txt += fpad2 + "'r'".ljust(pad) + "Re-run"
-                    if self.grader.allow_rebuild:
-                        input_txt += " (w/o rebuild)"
-                    input_txt += "\n"
-                    allowed_cmds.append("r")
-
-                # Remove trailing ", " and terminate
-                input_txt += ">>> " + TermColors.END
+                else:
+                    input_txt = header_txt + menu_txt
 
                 ################### Get and handle user input #######################
                 txt = input(input_txt)
@@ -320,15 +322,13 @@ class GradeItem:
                     scores = txt
                     break
 
-                # Check for integer input
-                try:
+                # Check for numeric input
+                if _SCORE_REGEX.fullmatch(txt):
                     score = float(txt)
                     if (points is None) or (0 <= score <= points):
                         scores.append(score)
                         break
                     print("Invalid input. Try again.")
-                except ValueError:
-                    pass
 
                 # Check for feedback input
                 if txt in allowed_feedback:
@@ -339,10 +339,10 @@ class GradeItem:
 
                 else:
                     txt = txt.capitalize()
-                    if txt not in self.feedback_list:
-                        self.feedback_list.append(txt)
-                        with open(self.feedback_list_path, "w", encoding="utf-8") as f:
-                            json.dump(self.feedback_list, f)
+                    if txt not in feedback_set:
+                        feedback_list.append(txt)
+                        feedback_set.add(txt)
+                        self._save_feedback(txt)
                     feedback_to_add = txt
 
                 # Assume input is feedback
@@ -355,3 +355,54 @@ class GradeItem:
                 return (scores, "")
 
         return (scores, feedback)
+
+    def _build_score_menu(self, points):
+        """Build the part of the grade prompt that lists the available inputs.  Returns the menu
+        text, the feedback that can be selected, and the allowed commands."""
+        fpad2 = " " * 4
+        pad = 10
+
+        # Add score input
+        menu = [
+            fpad2
+            + (("0-" + str(points)) if points else "#").ljust(pad)
+            + "Enter a score to finish and save\n"
+        ]
+
+        # Enter feedback
+        allowed_feedback = {}
+        if self.feedback_enabled:
+            menu.append(
+                fpad2
+                + "str".ljust(pad)
+                + "Enter a string with any new feedback, or select from previous feedback:\n"
+            )
+            for idx, f in enumerate(self.feedback_list):
+                menu.append(fpad2 + ("f" + str(idx)).ljust(pad + 2) + f + "\n")
+                allowed_feedback["f" + str(idx)] = f
+
+            menu.append(fpad2 + "'c'".ljust(pad) + "Clear entered feedback\n")
+            allowed_feedback["c"] = ""
+
+        menu.append(fpad2 + "'s'".ljust(pad) + "Skip to next student\n")
+        allowed_cmds = ["s"]
+
+        if self.grader.allow_rebuild:
+            menu.append(fpad2 + "'b'".ljust(pad) + "Build and run again\n")
+            allowed_cmds.append("b")
+        if self.grader.allow_rerun:
+            menu.append(fpad2 + "'r'".ljust(pad) + "Re-run")
+            if self.grader.allow_rebuild:
+                menu.append(" (w/o rebuild)")
+            menu.append("\n")
+            allowed_cmds.append("r")
+
+        # Terminate
+        menu.append(">>> " + TermColors.END)
+
+        return ("".join(menu), allowed_feedback, allowed_cmds)
+
+
+def _feedback_lines(feedback_list):
+    """Format feedback comments for the feedback list file, one JSON string per line"""
+    return "".join(json.dumps(feedback) + "\n" for feedback in feedback_list)
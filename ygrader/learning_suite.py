@@ -0,0 +1,202 @@
+""" Extract student submissions from the zip file downloaded from Learning Suite"""
+
+from collections import Counter, defaultdict
+import calendar
+import contextlib
+import functools
+import io
+import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+
+# Buffer size used when copying files out of zip archives
+_COPY_BUFFER_SIZE = 1 << 20
+
+# Whether os.utime() can be given a file descriptor (not supported on Windows)
+_UTIME_SUPPORTS_FD = os.utime in os.supports_fd
+
+# Files in the Learning Suite submissions zip are named either "<name>_<netid>_<file>" or
+# "<name> <netid>-<file>".  This matches (zero-width) at every position where a Net ID could start.
+_SUBMISSION_NETID_REGEX = re.compile(r"(?=_([^_]+)_| ([^-]+)-)")
+
+
+class ZipFilePerThread:
+    """Open a zip archive separately in each thread that uses it.  A ZipFile can't be shared
+    between threads: opening and closing members updates the reference count of its file handle
+    without holding its lock, so one thread could close the file while another is reading it.
+    ZipInfo objects from any ZipFile of the same archive can be used with the returned ZipFile."""
+
+    def __init__(self, zip_path):
+        self._zip_path = zip_path
+        self._local = threading.local()
+        self._exit_stack = contextlib.ExitStack()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the ZipFile for the calling thread, opening it on first use"""
+        zip_file = getattr(self._local, "zip_file", None)
+        if zip_file is None:
+            with self._lock:
+                zip_file = self._exit_stack.enter_context(zipfile.ZipFile(self._zip_path, "r"))
+            self._local.zip_file = zip_file
+        return zip_file
+
+    def close(self):
+        """Close the ZipFile of every thread"""
+        with self._lock:
+            self._exit_stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def index_submissions(top_zip, net_ids):
+    """Find the files submitted by each of the given Net IDs in the Learning Suite submissions zip,
+    in a single pass over the zip.  Returns a dict mapping Net IDs to a list of
+    (ZipInfo, name of the submitted file).  A file is listed under every Net ID that appears in
+    its name, as a student's name can contain another student's Net ID."""
+    net_ids = set(net_ids)
+    files_by_netid = defaultdict(list)
+    for file in top_zip.infolist():
+        if file.is_dir():
+            continue
+        for netid, extract_to_name in split_submission_filename(file.filename, net_ids).items():
+            files_by_netid[netid].append((file, extract_to_name))
+    return files_by_netid
+
+
+def extract_student_files(top_zip, net_ids, student_work_path, files_by_netid=None):
+    """Extract all files submitted by the given Net ID(s) from the Learning Suite submissions zip.
+    files_by_netid is the result of index_submissions(), which is computed for just these Net IDs
+    if not provided.  Returns the modified time (epoch) of the file extracted for each filename,
+    and the number of versions of each filename that were submitted."""
+    student_work_path.mkdir(parents=True, exist_ok=True)
+
+    if files_by_netid is None:
+        files_by_netid = index_submissions(top_zip, net_ids)
+
+    # Files of all group members, in the order they are stored in the zip.  A file that names
+    # more than one group member is only extracted once.
+    submitted_files = {}
+    for netid in dict.fromkeys(net_ids):
+        for file, extract_to_name in files_by_netid.get(netid, ()):
+            submitted_files.setdefault(file.header_offset, (file, extract_to_name))
+    submitted_files = [submitted_files[offset] for offset in sorted(submitted_files)]
+
+    # Keep track of the modified time of the last file extracted by name
+    extracted_by_name = {}
+
+    # Track how many files of each name are extracted so we can warn about duplicate submissions
+    count_by_filename = Counter()
+
+    # Build destination paths as plain strings, there can be thousands of files
+    base_path = os.fspath(student_work_path)
+
+    for file, extract_to_name in submitted_files:
+        # Handle regular files (not zip files)
+        if not file.filename.lower().endswith(".zip"):
+            mtime = zip_info_mtime(file)
+
+            count_by_filename[extract_to_name] += 1
+
+            # If we've already extracted a file of this name, don't overwrite if older
+            if extract_to_name in extracted_by_name:
+                if mtime <= extracted_by_name[extract_to_name]:
+                    continue
+
+            # Write directly to the name without the student name/netid
+            extract_zip_member(top_zip, file, os.path.join(base_path, extract_to_name), mtime)
+            extracted_by_name[extract_to_name] = mtime
+            continue
+
+        # Otherwise this is a zip within zip. Open it up and collect contained files.
+        # Reading a zip needs random access, and seeking backwards in a compressed member
+        # restarts decompression, so load the inner zip into memory first.
+        with zipfile.ZipFile(io.BytesIO(top_zip.read(file))) as inner_zip:
+            inner_files = [file2 for file2 in inner_zip.infolist() if not file2.is_dir()]
+            count_by_filename.update(file2.filename for file2 in inner_files)
+
+            for file2 in inner_files:
+                mtime = zip_info_mtime(file2)
+
+                # If we've already extracted a file of this name, don't overwrite if older
+                if file2.filename in extracted_by_name:
+                    if mtime <= extracted_by_name[file2.filename]:
+                        continue
+
+                unpack_path = zip_member_dest_path(base_path, file2.filename)
+                os.makedirs(os.path.dirname(unpack_path), exist_ok=True)
+                extract_zip_member(inner_zip, file2, unpack_path, mtime)
+                extracted_by_name[file2.filename] = mtime
+
+    return (extracted_by_name, count_by_filename)
+
+
+def split_submission_filename(filename, net_ids):
+    """Find the Net IDs (from net_ids) in a filename from the Learning Suite submissions zip.
+    Returns a dict mapping each Net ID found to the name of the submitted file that follows it.
+    Each Net ID is matched at its first "_<netid>_", or its first " <netid>-" if there is none."""
+    underscore_matches = {}
+    space_matches = {}
+    for match in _SUBMISSION_NETID_REGEX.finditer(filename):
+        if match.group(1) is not None:
+            netid, matches = match.group(1), underscore_matches
+        else:
+            netid, matches = match.group(2), space_matches
+        if netid in net_ids and netid not in matches:
+            matches[netid] = filename[match.start() + len(netid) + 2 :]
+    return {**space_matches, **underscore_matches}
+
+
+def zip_info_mtime(zip_info):
+    """Return the modified time of a file in a zip archive, as (integer) seconds since the epoch"""
+    date_time = zip_info.date_time
+    try:
+        return calendar.timegm(date_time) - _utc_offset(date_time[:4])
+    except ValueError:
+        # Some zip tools write a zero date (month and day of 0), which mktime() normalizes
+        return int(time.mktime(date_time + (0, 0, -1)))
+
+
+@functools.lru_cache(maxsize=None)
+def _utc_offset(date_hour):
+    """Return the local UTC offset (seconds) for a local (year, month, day, hour).  Zip timestamps
+    are in local time, and resolving the timezone with mktime() is comparatively slow, so this is
+    only done once per hour of timestamps."""
+    return calendar.timegm(date_hour + (0, 0)) - int(time.mktime(date_hour + (0, 0, 0, 0, -1)))
+
+
+def zip_member_dest_path(base_path, filename):
+    """Return the path under base_path that a zip member should be extracted to.  Like
+    ZipFile.extract(), drive letters and empty, '.' and '..' components are removed so that
+    files can't be written outside of base_path."""
+    parts = os.path.splitdrive(filename)[1].split("/")
+    parts = [part for part in parts if part not in ("", ".", "..")]
+    return os.path.join(base_path, *parts)
+
+
+def extract_zip_member(zip_file, zip_info, dest_path, mtime):
+    """Stream a single file out of an open zip archive to dest_path, and set its modified time"""
+    # Zip timestamps are whole seconds, so give utime exact integer nanoseconds
+    mtime_ns = mtime * 1_000_000_000
+
+    with open(dest_path, "wb") as dst:
+        # Empty files (e.g. __init__.py) don't need to be opened and decompressed
+        if zip_info.file_size:
+            with zip_file.open(zip_info) as src:
+                shutil.copyfileobj(src, dst, length=_COPY_BUFFER_SIZE)
+
+        # Set the time through the open file descriptor where possible, which saves
+        # the kernel from looking up the path again
+        if _UTIME_SUPPORTS_FD:
+            dst.flush()
+            os.utime(dst.fileno(), ns=(mtime_ns, mtime_ns))
+
+    if not _UTIME_SUPPORTS_FD:
+        os.utime(dest_path, ns=(mtime_ns, mtime_ns))
@@ -4,13 +4,13 @@ import subprocess
 import sys
 import re
 
-from .utils import print_color, TermColors
+from .utils import directory_is_empty, print_color, TermColors
 
 
 def clone_repo(git_path, tag, student_repo_path):
     """Clone the student repository"""
 
-    if student_repo_path.is_dir() and list(student_repo_path.iterdir()):
+    if student_repo_path.is_dir() and not directory_is_empty(student_repo_path):
         print_color(
             TermColors.BLUE,
             "Student repo",
@@ -1,5 +1,6 @@
 """ ygrader utility functions"""
 
+import os
 import pathlib
 import sys
 import shutil
@@ -22,7 +23,8 @@ class TermColors:
 
 def print_color(color, *msg):
     """Print a message in color"""
-    print(color + " ".join(str(item) for item in msg), TermColors.END)
+    # Pass print() a single string, so the message is written in one piece
+    print(color + " ".join(str(item) for item in msg) + " " + TermColors.END)
 
 
 def error(*msg, returncode=-1):
@@ -137,4 +139,6 @@ def ensure_tuple(x):
 
 def directory_is_empty(directory: pathlib.Path) -> bool:
     """Returns whether the given directory is empty"""
-    return not any(directory.iterdir())
+    # os.scandir stops reading at the first entry, whereas Path.iterdir lists the whole directory
+    with os.scandir(directory) as it:
+        return next(it, None) is None